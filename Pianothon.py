@@ -2,34 +2,38 @@ from TikTokLive import TikTokLiveClient
 from TikTokLive.types.events import GiftEvent
 import pygame
 import multiprocessing
+from queue import Empty, Full
+from functools import lru_cache
 from math import *
-from PIL import Image, ImageDraw
 
 # Initialize pygame
 pygame.init()
 
+# Fonts are looked up by id so the render cache key stays hashable
+fonts = {}
+
+# Rendered text plus its rect, anchor is a Rect attribute like "center" or "topleft"
+@lru_cache(maxsize=512)
+def place_cached(font_id, text, color, anchor, pos):
+    surface = fonts[font_id].render(text, True, color)
+    return((surface, surface.get_rect(**{anchor: pos})))
+
 # Your main loop
 thankvalue = 1
 
-def mainloop(totalcoins, thankstr):
+def mainloop(totalcoins, thankq):
     global thankvalue
 
     def calcpieend(target, cur, speed):
         newStartpie = cur+(target-cur)/50
         return(newStartpie)
-    def updatethank():
-        return(thankstr.value)
-    def calcminadded(c):
-        coins = c
-        added = 0
-        for q in range(30):
-            #print(f"q is {q}")
-            for i in range(15):
-                #print(f"removing {basecoinsthres+incr*q} from coins play time is now: {15+added}")
-                coins -= basecoinsthres+incr*q
-                if coins < 0:
-                    return(added)
-                added += 1
+    def updatethank(current):
+        # Drain the queue and keep the newest thank, the producer never waits on us
+        try:
+            while True:
+                current = thankq.get_nowait()
+        except Empty:
+            return(current)
 
 
     white = (230,230,230)
@@ -50,6 +54,10 @@ def mainloop(totalcoins, thankstr):
 
     infocenterx = width-(width-((height-timers)/2+timers))/2
 
+    # Pie edge points on screen for every whole degree from -90 to 270, index 0 is -90
+    pier = timers/2
+    pie_pts = [(timercx+pier*cos(radians(a)), timercy+pier*sin(radians(a))) for a in range(-90, 271)]
+
     incr = 5
     basecoinsthres = 15
     coinsthres = basecoinsthres
@@ -57,56 +65,55 @@ def mainloop(totalcoins, thankstr):
     addedmins = 0
     pieSpeed = 1
 
-    thanklist = []
     activethank = ""
 
     oldReached = 0
     curStartpie = -90
+    lastcoinsthres = coinsthres
+    last_secondsleft = None
 
     font = pygame.font.Font('RobotoMono-Regular.ttf', int(timers/5))
     font2 = pygame.font.Font('freesansbold.ttf', 40)
     fontsmall = pygame.font.Font('freesansbold.ttf', 16)
     fontinfo = pygame.font.Font('freesansbold.ttf', 70)
+    for f in (font, font2, fontsmall, fontinfo):
+        fonts[id(f)] = f
 
     display = pygame.display.set_mode((width,height))
     pygame.display.set_caption('Pianothon by cwallerstedt')
+    clock = pygame.time.Clock()
+
+    infoline1 = place_cached(id(fontinfo), f"For every {coinsthres} coins", white, "center", (infocenterx,240))
+    infoline2 = place_cached(id(fontinfo), "1 minute is added", white, "center", (infocenterx,305))
+
+    # Only regions that changed are redrawn and pushed to the screen
+    dialrect = pygame.Rect(0, 0, timers+10, timers+10)
+    dialrect.center = (timercx,timercy)
+    lastdialstate = None
+    shown = []
+    redrawall = True
 
     while running:
+        tc = totalcoins.value
         millis = pygame.time.get_ticks()
-        secondsleft = int (round((starttime+addedmins*60-pygame.time.get_ticks()/1000),0))
-        m, s = divmod(secondsleft, 60)
-        h, m = divmod(m, 60)
-        timeleftstr = str(f'{h:d}:{m:02d}:{s:02d}')
+        secondsleft = floor(starttime+addedmins*60-millis/1000+0.5)
         
-        if thankstr.value not in thanklist:
-            thanklist.append(thankstr.value)
-        if millis%4000<40:
-            activethank = updatethank()
-
-
-        if totalcoins.value < 15*basecoinsthres:
-            print("1 QUARTER")
-            coinsthres = basecoinsthres  # Access the value attribute
-        elif totalcoins.value < 15*basecoinsthres+incr*1:
-            print("2 QUARTER")
-            coinsthres = basecoinsthres+incr*1
-        elif totalcoins.value < 15*basecoinsthres+incr*2:
-            print("3 QUARTER")
-            coinsthres = basecoinsthres+incr*2
-        elif totalcoins.value < 15*basecoinsthres+incr*3:
-            coinsthres = basecoinsthres+incr*3
-        elif totalcoins.value < 15*basecoinsthres+incr*4:
-            coinsthres = basecoinsthres+incr*4
-        elif totalcoins.value < 15*basecoinsthres+incr*5:
-            coinsthres = basecoinsthres+incr*5
-        elif totalcoins.value < 15*basecoinsthres+incr*6:
-            coinsthres = basecoinsthres+incr*6
-        elif totalcoins.value < 15*basecoinsthres+incr*7:
-            coinsthres = basecoinsthres+incr*7
-        elif totalcoins.value < 15*basecoinsthres+incr*8:
-            coinsthres = basecoinsthres+incr*8
+        activethank = updatethank(activethank)
+
+
+        # Threshold grows by incr for every incr coins past 15 minutes, up to 8 steps
+        over = tc - 15*basecoinsthres
+        if over < 0:
+            q = 0
+        else:
+            q = min(8, over//incr+1)
+        coinsthres = basecoinsthres+incr*q
+        if coinsthres != lastcoinsthres:
+            place_cached.cache_clear()
+            infoline1 = place_cached(id(fontinfo), f"For every {coinsthres} coins", white, "center", (infocenterx,240))
+            lastcoinsthres = coinsthres
         
-        reached = totalcoins.value / coinsthres
+        reached = tc / coinsthres
         desStartpie = reached*360-90
         startpie = calcpieend(desStartpie,curStartpie,pieSpeed)
         curStartpie = startpie
@@ -117,102 +124,126 @@ def mainloop(totalcoins, thankstr):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = 0
+            elif event.type == pygame.VIDEOEXPOSE:
+                redrawall = True
             #print(event)
 
-        display.fill((0,0,0))
-        pygame.draw.circle(display,white,(timercx,timercy),timers/2+4)
-        pygame.draw.circle(display,indicator,(timercx,timercy),timers/2)
-        #### pieslice
-        pil_size = timers
-        pil_image = Image.new("RGBA", (pil_size, pil_size))
-        pil_draw = ImageDraw.Draw(pil_image)
-        pil_draw.pieslice((0, 0, pil_size-1, pil_size-1), startpie, 270, fill=indicatorbg) 
-        mode = pil_image.mode
-        size = pil_image.size
-        data = pil_image.tobytes()
-        image = pygame.image.fromstring(data, size, mode)
-        image_rect = image.get_rect(center=(timercx,timercy))
-        display.blit(image, image_rect) # <- display image
-        ####
-        pygame.draw.circle(display,white,(timercx,timercy),timers/2-timers/25)
-
-        timetext = font.render(timeleftstr, True, dgrey, white)
-        timetextRect = timetext.get_rect()
-        timetextRect.center = ((timercx,timercy))
-        display.blit(timetext, timetextRect)
-
-        addedtext = font2.render(str(totalcoins.value%coinsthres)+"/"+str(coinsthres)+" Coins", True, dgrey)
-        addedtextRect = addedtext.get_rect()
-        addedtextRect.center = ((timercx,timercy+timers/7))
-        display.blit(addedtext, addedtextRect)
-
-        totalcointext = fontsmall.render(str(totalcoins.value), True, (100,100,100))
-        totalcoinRect = totalcointext.get_rect()
-        totalcoinRect.topleft = ((2,2))
-        display.blit(totalcointext, totalcoinRect)
-
-        totaltimetext = fontsmall.render(str(int((millis/1000)/60)), True, (100,100,100))
-        totaltimeRect = totaltimetext.get_rect()
-        totaltimeRect.bottomleft = ((2,height-2))
-        display.blit(totaltimetext, totaltimeRect)
+        if secondsleft != last_secondsleft:
+            m, s = divmod(secondsleft, 60)
+            h, m = divmod(m, 60)
+            timeleftstr = str(f'{h:d}:{m:02d}:{s:02d}')
+            timetext = font.render(timeleftstr, True, dgrey, white)
+            timetextpair = (timetext, timetext.get_rect(center=(timercx,timercy)))
+            last_secondsleft = secondsleft
+        coinpair = place_cached(id(font2), str(tc%coinsthres)+"/"+str(coinsthres)+" Coins", dgrey, "center", (timercx,timercy+timers/7))
+
         if addedmins >= 60:
             hrs,mins = divmod(addedmins,60)
             timeaddedstr = (f"{hrs} Hours {mins} Minutes")
         else:
             timeaddedstr = (f"{addedmins} Minutes")
-        InfoTexttext = fontinfo.render(f"For every {coinsthres} coins", True, white)
-        InfoTextRect = InfoTexttext.get_rect()
-        InfoTextRect.center = ((infocenterx,240))
-        display.blit(InfoTexttext, InfoTextRect)
-        InfoTexttext = fontinfo.render("1 minute is added", True, white)
-        InfoTextRect = InfoTexttext.get_rect()
-        InfoTextRect.center = ((infocenterx,305))
-        display.blit(InfoTexttext, InfoTextRect)
-
-        addedtext = font2.render(timeaddedstr, True, (indicator))
-        addedtextRect = addedtext.get_rect()
-        addedtextRect.center = (width*4/5,height/2)
-        display.blit(addedtext, addedtextRect)
-
-        thanktext = font2.render(activethank, True, white)
-        thanktextRect = thanktext.get_rect()
-        thanktextRect.center = (infocenterx-100,30)
-        display.blit(thanktext, thanktextRect)
 
-        
-        
-        pygame.display.update()
+        texts = [
+            place_cached(id(fontsmall), str(tc), (100,100,100), "topleft", (2,2)),
+            place_cached(id(fontsmall), str(int((millis/1000)/60)), (100,100,100), "bottomleft", (2,height-2)),
+            infoline1,
+            infoline2,
+            place_cached(id(font2), timeaddedstr, indicator, "center", (width*4/5,height/2)),
+            place_cached(id(font2), activethank, white, "center", (infocenterx-100,30)),
+        ]
+
+        # Wipe the old and new spot of every text that changed
+        cleared = []
+        redraw = set()
+        if redrawall:
+            cleared.append(display.get_rect())
+            shown = [None]*len(texts)
+        for i in range(len(texts)):
+            if texts[i] != shown[i]:
+                redraw.add(i)
+                if shown[i] is not None:
+                    cleared.append(shown[i][1])
+                cleared.append(texts[i][1])
+
+        pielo = (int(startpie)+90)%360
+        dialstate = (pielo, timetextpair, coinpair)
+        redrawdial = dialstate != lastdialstate
+        if redrawdial:
+            cleared.append(dialrect)
+
+        # Anything touching a wiped area is wiped whole and redrawn, so no
+        # antialiased text is ever blended onto its own old pixels
+        grown = True
+        while grown:
+            grown = False
+            if not redrawdial and dialrect.collidelist(cleared) != -1:
+                redrawdial = True
+                cleared.append(dialrect)
+                grown = True
+            for i in range(len(texts)):
+                if i not in redraw and texts[i][1].collidelist(cleared) != -1:
+                    redraw.add(i)
+                    cleared.append(texts[i][1])
+                    grown = True
+
+        for rect in cleared:
+            display.fill((0,0,0), rect)
+        if redrawdial:
+            pygame.draw.circle(display,white,(timercx,timercy),timers/2+4)
+            pygame.draw.circle(display,indicator,(timercx,timercy),timers/2)
+            #### pieslice, drawn clockwise from startpie to 270 like PIL's pieslice
+            pygame.draw.polygon(display, indicatorbg, [(timercx,timercy)]+pie_pts[pielo:])
+            ####
+            pygame.draw.circle(display,white,(timercx,timercy),timers/2-timers/25)
+            display.blits((timetextpair, coinpair), doreturn=False)
+            lastdialstate = dialstate
+        for i in sorted(redraw):
+            display.blit(*texts[i])
+            shown[i] = texts[i]
+
+        if redrawall:
+            pygame.display.update()
+            redrawall = False
+        elif cleared:
+            pygame.display.update(cleared)
+        clock.tick(60)
 
 if __name__ == '__main__':
-    # Initialize multiprocessing manager
-    manager = multiprocessing.Manager()
-    totalcoins = manager.Value('i', 0)  # Create a shared integer variable
-    thankstr = manager.Value("c","")
+    # Shared memory instead of Manager proxies, the render loop reads this every frame
+    totalcoins = multiprocessing.Value('i', 0)
+    thankq = multiprocessing.Queue(maxsize=64)
     def giftreceived(coins):
-        totalcoins.value += coins
+        with totalcoins.get_lock():
+            totalcoins.value += coins
         print("total coins:", totalcoins.value)
+    def setthank(text):
+        try:
+            thankq.put_nowait(text)
+        except Full:
+            pass
 
     client = TikTokLiveClient("@layla.faveri")
 
-    mainloop_process = multiprocessing.Process(target=mainloop, args=(totalcoins,thankstr))
+    mainloop_process = multiprocessing.Process(target=mainloop, args=(totalcoins,thankq))
     mainloop_process.start()
 
     # Define the event handler after defining the client
     @client.on("gift")
     async def on_gift(event: GiftEvent):
-        if event.gift.streakable and not event.gift.streaking:
-            print(int(event.gift.info.diamond_count)*int(event.gift.count))
-            giftreceived(int(event.gift.info.diamond_count)*int(event.gift.count))
-            if(int(event.gift.info.diamond_count)*int(event.gift.count)>=thankvalue):
-                thankstr.value = (f"Thanks to {event.user.nickname}")
-                print(thankstr.value)
-
-        elif not event.gift.streakable:
-            print(int(event.gift.info.diamond_count))
-            giftreceived(int(event.gift.info.diamond_count))
-            if(int(event.gift.info.diamond_count)>=thankvalue):
-                thankstr.value = (f"Thanks to {event.user.nickname}")
-                print(thankstr.value)
+        gift = event.gift
+        # Streakable gifts are only counted once the streak ends
+        if gift.streakable and gift.streaking:
+            return
+        if gift.streakable:
+            value = int(gift.info.diamond_count)*int(gift.count)
+        else:
+            value = int(gift.info.diamond_count)
+        print(value)
+        giftreceived(value)
+        if value >= thankvalue:
+            thanks = f"Thanks to {event.user.nickname}"
+            setthank(thanks)
+            print(thanks)
 
     # Start the TikTokLive client in the main process
     client.run()
@@ -1,11 +1,14 @@
 import argparse
 import asyncio
+import atexit
 import json
 import logging
 import os
-import time
+import signal
+import sys
+from collections import deque
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional
 
 try:
     from TikTokLive import TikTokLiveClient
@@ -22,12 +25,23 @@ except Exception as import_error:  # pragma: no cover
     )
     raise SystemExit(0)
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 
 def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
 def to_int(value: Any, default: int = 0) -> int:
+    # TikTokLive hands us plain ints almost always; exact type checks skip the MRO walk.
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if value_type is float:
+        return int(value)
     if isinstance(value, bool):
         return int(value)
     if isinstance(value, int):
@@ -48,68 +62,55 @@ def as_str(value: Any) -> Optional[str]:
     return None
 
 
-def find_first_string(data: Any, keys: set[str]) -> Optional[str]:
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key in keys and isinstance(value, str) and value.strip():
-                return value.strip()
-            found = find_first_string(value, keys)
-            if found:
-                return found
-    elif isinstance(data, list):
-        for item in data:
-            found = find_first_string(item, keys)
-            if found:
-                return found
+# Prefer explicit concurrent-viewer keys from room_info.
+# NOTE: `user_count` is often inflated for some rooms and does not reliably
+# match the on-screen live viewer count, so we intentionally ignore it.
+CURRENT_VIEWER_KEYS = frozenset({"watch_user_count", "viewer_count", "viewerCount", "room_user_count"})
+# Cumulative enter/total watcher signals.
+TOTAL_ENTER_KEYS = frozenset({"total_user", "totalUser", "enter_count", "enterCount", "total_enter_count"})
+LIKE_COUNT_KEYS = frozenset({"like_count", "likeCount", "m_popularity", "total_like", "likes"})
+TITLE_KEYS = frozenset({"title", "room_title", "live_title"})
+
+
+def find_first_string(data: Any, keys: frozenset[str]) -> Optional[str]:
+    # Depth-first in document order, same as a recursive walk but without the call overhead.
+    stack: List[Any] = [(None, data)]
+    while stack:
+        key, value = stack.pop()
+        if key in keys and isinstance(value, str) and value.strip():
+            return value.strip()
+        if isinstance(value, dict):
+            stack.extend(reversed(list(value.items())))
+        elif isinstance(value, list):
+            stack.extend((None, item) for item in reversed(value))
     return None
 
 
-def find_max_int(data: Any, keys: set[str]) -> int:
+def find_max_int(data: Any, keys: frozenset[str]) -> int:
     best = 0
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key in keys:
-                best = max(best, to_int(value, 0))
-            best = max(best, find_max_int(value, keys))
-    elif isinstance(data, list):
-        for item in data:
-            best = max(best, find_max_int(item, keys))
+    stack: List[Any] = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in keys:
+                    best = max(best, to_int(item, 0))
+                stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
     return best
 
 
 def parse_current_viewers_from_room_info(room_info: Dict[str, Any]) -> int:
-    # Prefer explicit concurrent-viewer keys from room_info.
-    # NOTE: `user_count` is often inflated for some rooms and does not reliably
-    # match the on-screen live viewer count, so we intentionally ignore it.
-    return max(
-        0,
-        find_max_int(
-            room_info,
-            {
-                "watch_user_count",
-                "viewer_count",
-                "viewerCount",
-                "room_user_count",
-            },
-        ),
-    )
+    return max(0, find_max_int(room_info, CURRENT_VIEWER_KEYS))
 
 
 def parse_total_enters_from_room_info(room_info: Dict[str, Any]) -> int:
-    # Cumulative enter/total watcher signals.
-    return max(
-        0,
-        find_max_int(
-            room_info,
-            {
-                "total_user",
-                "totalUser",
-                "enter_count",
-                "enterCount",
-                "total_enter_count",
-            },
-        ),
-    )
+    return max(0, find_max_int(room_info, TOTAL_ENTER_KEYS))
+
+
+# Cap on retained samples so open-ended stream captures keep bounded memory.
+MAX_SAMPLES = 10_000
 
 
 class LiveCaptureState:
@@ -123,9 +124,18 @@ class LiveCaptureState:
         self.current_viewers: int = 0
         self.current_likes: int = 0
         self.current_enters: int = 0
-        self.samples: List[Dict[str, Any]] = []
+        self.samples: Deque[Dict[str, Any]] = deque(maxlen=MAX_SAMPLES)
         self.comments: List[Dict[str, Any]] = []
         self.gifts: List[Dict[str, Any]] = []
+        self.disconnected = asyncio.Event()
+        self.failure: Optional[BaseException] = None
+
+    def fail(self, error: BaseException) -> None:
+        # Errors raised in loop callbacks would otherwise only be logged by asyncio;
+        # keep the first one and wake the capture so it can re-raise it.
+        if self.failure is None:
+            self.failure = error
+        self.disconnected.set()
 
     def snapshot(self) -> Dict[str, Any]:
         return {
@@ -151,8 +161,114 @@ class LiveCaptureState:
         return sample
 
 
+async def sample_until_done(
+    state: LiveCaptureState,
+    duration_sec: Optional[float],
+    sample_interval_sec: float,
+    on_sample: Callable[[Dict[str, Any]], None],
+) -> None:
+    # Samples fire from loop timers on a fixed cadence; we only wake up for the
+    # deadline (None waits forever), a disconnect or a failed sample.
+    loop = asyncio.get_running_loop()
+    next_sample_at = loop.time()
+    handle: Optional[asyncio.TimerHandle] = None
+
+    def take_sample() -> None:
+        nonlocal next_sample_at, handle
+        try:
+            on_sample(state.add_sample())
+        except Exception as sample_error:
+            state.fail(sample_error)
+            return
+        next_sample_at += sample_interval_sec
+        handle = loop.call_at(next_sample_at, take_sample)
+
+    take_sample()
+    try:
+        await asyncio.wait_for(state.disconnected.wait(), timeout=duration_sec)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        if handle is not None:
+            handle.cancel()
+    if state.failure is not None:
+        raise state.failure
+
+
+# Stream lines are batched and flushed on a short timer or once the buffer is big
+# enough, instead of one write syscall per event.
+EMIT_FLUSH_BYTES = 16384
+EMIT_FLUSH_SEC = 0.05
+_emit_buffer = bytearray()
+_emit_flush_handle: Optional[asyncio.TimerHandle] = None
+_emit_error: Optional[BaseException] = None
+_emit_error_handler: Optional[Callable[[BaseException], None]] = None
+
+
+def on_emit_error(handler: Callable[[BaseException], None]) -> None:
+    # Timer flushes run as loop callbacks, so a failed write is reported here
+    # instead of being raised to the capture.
+    global _emit_error_handler
+    _emit_error_handler = handler
+
+
+def flush_emitted() -> None:
+    global _emit_flush_handle, _emit_error
+    if _emit_flush_handle is not None:
+        _emit_flush_handle.cancel()
+        _emit_flush_handle = None
+    if not _emit_buffer or _emit_error is not None:
+        _emit_buffer.clear()
+        return
+    try:
+        sys.stdout.buffer.write(_emit_buffer)
+        sys.stdout.buffer.flush()
+    except Exception as write_error:
+        # Once stdout is broken nothing more is buffered; emit_line re-raises from now on.
+        _emit_error = write_error
+        if _emit_error_handler is not None:
+            _emit_error_handler(write_error)
+        raise
+    finally:
+        _emit_buffer.clear()
+
+
+def flush_emitted_later() -> None:
+    try:
+        flush_emitted()
+    except Exception:
+        pass  # Recorded in _emit_error and handed to _emit_error_handler.
+
+
+atexit.register(flush_emitted)
+
+
+def exit_on_sigterm(signum: int, _frame: Any) -> None:
+    # The Node side stops streams with SIGTERM; exiting normally lets atexit flush
+    # the lines still sitting in the batch buffer.
+    raise SystemExit(128 + signum)
+
+
 def emit_line(payload: Dict[str, Any]) -> None:
-    print(json.dumps(payload, ensure_ascii=True), flush=True)
+    global _emit_flush_handle
+    if _emit_error is not None:
+        raise _emit_error
+    # orjson emits UTF-8 bytes, so skip the text layer and write to the raw buffer.
+    if orjson is not None:
+        _emit_buffer.extend(orjson.dumps(payload))
+    else:
+        _emit_buffer.extend(json.dumps(payload, ensure_ascii=True).encode("ascii"))
+    _emit_buffer.extend(b"\n")
+    if len(_emit_buffer) >= EMIT_FLUSH_BYTES:
+        flush_emitted()
+        return
+    if _emit_flush_handle is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            flush_emitted()
+            return
+        _emit_flush_handle = loop.call_later(EMIT_FLUSH_SEC, flush_emitted_later)
 
 
 def apply_optional_session(client: TikTokLiveClient, state: LiveCaptureState) -> None:
@@ -166,34 +282,54 @@ def apply_optional_session(client: TikTokLiveClient, state: LiveCaptureState) ->
         state.warnings.append(f"session cookie setup failed: {session_error}")
 
 
-async def bootstrap_client(
-    state: LiveCaptureState,
-    client: TikTokLiveClient,
-    *,
-    emit_events: bool,
-    precheck_live: bool,
-    collect_chat: bool,
-    max_comments: int,
-    max_gifts: int,
-) -> bool:
-    @client.on(ConnectEvent)
-    async def on_connect(event: ConnectEvent) -> None:
+class LiveEventHandlers:
+    # Capture settings live on one slotted instance and the handlers are its bound
+    # methods, so nothing is rebuilt per bootstrap and no closure cells are read per event.
+    __slots__ = ("state", "emit_events", "collect_chat", "max_comments", "max_gifts")
+
+    def __init__(
+        self,
+        state: LiveCaptureState,
+        *,
+        emit_events: bool,
+        collect_chat: bool,
+        max_comments: int,
+        max_gifts: int,
+    ):
+        self.state = state
+        self.emit_events = emit_events
+        self.collect_chat = collect_chat
+        self.max_comments = max_comments
+        self.max_gifts = max_gifts
+
+    def register(self, client: TikTokLiveClient) -> None:
+        client.on(ConnectEvent)(self.on_connect)
+        client.on(DisconnectEvent)(self.on_disconnect)
+        client.on(RoomUserSeqEvent)(self.on_room_user_seq)
+        client.on(LikeEvent)(self.on_like)
+        client.on(CommentEvent)(self.on_comment)
+        client.on(GiftEvent)(self.on_gift)
+
+    async def on_connect(self, event: ConnectEvent) -> None:
+        state = self.state
         state.is_live = True
         state.status_code = 1
         state.room_id = str(getattr(event, "room_id", "") or "").strip() or state.room_id
-        if emit_events:
+        if self.emit_events:
             emit_line({"type": "meta", **state.snapshot()})
 
-    @client.on(DisconnectEvent)
-    async def on_disconnect(_: DisconnectEvent) -> None:
+    async def on_disconnect(self, _: DisconnectEvent) -> None:
+        state = self.state
         if state.status_code == 1:
             state.status_code = 2
-
-    @client.on(RoomUserSeqEvent)
-    async def on_room_user_seq(event: RoomUserSeqEvent) -> None:
-        viewers = to_int(getattr(event, "m_total", 0), 0)
-        enters = to_int(getattr(event, "total_user", 0), 0)
-        likes = to_int(getattr(event, "m_popularity", 0), 0)
+        state.disconnected.set()
+
+    async def on_room_user_seq(self, event: RoomUserSeqEvent) -> None:
+        state = self.state
+        _to_int = to_int
+        viewers = _to_int(getattr(event, "m_total", 0), 0)
+        enters = _to_int(getattr(event, "total_user", 0), 0)
+        likes = _to_int(getattr(event, "m_popularity", 0), 0)
         if viewers > 0:
             state.current_viewers = viewers
         if enters > 0:
@@ -201,15 +337,13 @@ async def bootstrap_client(
         if likes > 0:
             state.current_likes = max(state.current_likes, likes)
 
-    @client.on(LikeEvent)
-    async def on_like(event: LikeEvent) -> None:
+    async def on_like(self, event: LikeEvent) -> None:
         total_likes = to_int(getattr(event, "total", 0), 0)
         if total_likes > 0:
-            state.current_likes = max(state.current_likes, total_likes)
+            self.state.current_likes = max(self.state.current_likes, total_likes)
 
-    @client.on(CommentEvent)
-    async def on_comment(event: CommentEvent) -> None:
-        if not collect_chat or max_comments == 0 or len(state.comments) >= max_comments:
+    async def on_comment(self, event: CommentEvent) -> None:
+        if not self.collect_chat or self.max_comments == 0 or len(self.state.comments) >= self.max_comments:
             return
 
         user = getattr(event, "user", None)
@@ -219,13 +353,12 @@ async def bootstrap_client(
             "nickname": as_str(getattr(user, "nickname", None)),
             "comment": as_str(getattr(event, "comment", None)) or "",
         }
-        state.comments.append(row)
-        if emit_events:
+        self.state.comments.append(row)
+        if self.emit_events:
             emit_line({"type": "comment", **row})
 
-    @client.on(GiftEvent)
-    async def on_gift(event: GiftEvent) -> None:
-        if not collect_chat or max_gifts == 0 or len(state.gifts) >= max_gifts:
+    async def on_gift(self, event: GiftEvent) -> None:
+        if not self.collect_chat or self.max_gifts == 0 or len(self.state.gifts) >= self.max_gifts:
             return
 
         gift_obj = getattr(event, "gift", None)
@@ -236,16 +369,17 @@ async def bootstrap_client(
             return
 
         user = getattr(event, "user", None)
+        _to_int = to_int
         diamond_count = max(
             0,
-            to_int(getattr(gift_obj, "diamond_count", 0), 0),
-            to_int(getattr(gift_info, "diamond_count", 0), 0),
+            _to_int(getattr(gift_obj, "diamond_count", 0), 0),
+            _to_int(getattr(gift_info, "diamond_count", 0), 0),
         )
         repeat_count = max(
             1,
-            to_int(getattr(event, "repeat_count", 0), 0),
-            to_int(getattr(event, "count", 0), 0),
-            to_int(getattr(gift_obj, "count", 0), 0),
+            _to_int(getattr(event, "repeat_count", 0), 0),
+            _to_int(getattr(event, "count", 0), 0),
+            _to_int(getattr(gift_obj, "count", 0), 0),
         )
         row = {
             "createdAt": now_iso(),
@@ -255,10 +389,29 @@ async def bootstrap_client(
             "diamondCount": diamond_count,
             "repeatCount": repeat_count,
         }
-        state.gifts.append(row)
-        if emit_events:
+        self.state.gifts.append(row)
+        if self.emit_events:
             emit_line({"type": "gift", **row})
 
+
+async def bootstrap_client(
+    state: LiveCaptureState,
+    client: TikTokLiveClient,
+    *,
+    emit_events: bool,
+    precheck_live: bool,
+    collect_chat: bool,
+    max_comments: int,
+    max_gifts: int,
+) -> bool:
+    LiveEventHandlers(
+        state,
+        emit_events=emit_events,
+        collect_chat=collect_chat,
+        max_comments=max_comments,
+        max_gifts=max_gifts,
+    ).register(client)
+
     if precheck_live:
         live_check = bool(await client.is_live())
         if not live_check:
@@ -279,13 +432,13 @@ async def bootstrap_client(
 
     room_info = client.room_info or {}
     state.room_id = state.room_id or (str(client.room_id) if client.room_id else None)
-    state.title = find_first_string(room_info, {"title", "room_title", "live_title"})
+    state.title = find_first_string(room_info, TITLE_KEYS)
     room_info_viewers = parse_current_viewers_from_room_info(room_info)
     if state.current_viewers <= 0 and room_info_viewers > 0:
         state.current_viewers = room_info_viewers
     state.current_likes = max(
         state.current_likes,
-        find_max_int(room_info, {"like_count", "likeCount", "m_popularity", "total_like", "likes"}),
+        find_max_int(room_info, LIKE_COUNT_KEYS),
     )
     state.current_enters = max(state.current_enters, parse_total_enters_from_room_info(room_info))
 
@@ -330,35 +483,27 @@ async def capture_live(args: argparse.Namespace) -> Dict[str, Any]:
                 "ok": True,
                 "mode": mode,
                 **state.snapshot(),
-                "samples": state.samples,
+                "samples": list(state.samples),
                 "comments": state.comments,
                 "gifts": state.gifts,
                 "warnings": state.warnings,
             }
 
         if mode == "check":
-            probe_end = time.monotonic() + 3
-            while time.monotonic() < probe_end:
-                await asyncio.sleep(0.2)
+            await asyncio.sleep(3)
             state.add_sample()
             await safe_disconnect(client, state)
             return {
                 "ok": True,
                 "mode": mode,
                 **state.snapshot(),
-                "samples": state.samples,
+                "samples": list(state.samples),
                 "comments": state.comments,
                 "gifts": state.gifts,
                 "warnings": state.warnings,
             }
 
-        stop_at = time.monotonic() + duration_sec
-        next_sample_at = time.monotonic()
-        while time.monotonic() < stop_at:
-            if time.monotonic() >= next_sample_at:
-                state.add_sample()
-                next_sample_at += sample_interval_sec
-            await asyncio.sleep(0.15)
+        await sample_until_done(state, duration_sec, sample_interval_sec, lambda _: None)
 
         state.add_sample()
         await safe_disconnect(client, state)
@@ -367,7 +512,7 @@ async def capture_live(args: argparse.Namespace) -> Dict[str, Any]:
             "ok": True,
             "mode": mode,
             **state.snapshot(),
-            "samples": state.samples,
+            "samples": list(state.samples),
             "comments": state.comments,
             "gifts": state.gifts,
             "warnings": state.warnings,
@@ -380,7 +525,7 @@ async def capture_live(args: argparse.Namespace) -> Dict[str, Any]:
             "username": username,
             "error": str(capture_error),
             "warnings": state.warnings,
-            "samples": state.samples,
+            "samples": list(state.samples),
             "comments": state.comments,
             "gifts": state.gifts,
         }
@@ -395,6 +540,7 @@ async def capture_live_stream(args: argparse.Namespace) -> int:
     collect_chat = bool(args.collect_chat)
 
     state = LiveCaptureState(username=username)
+    on_emit_error(state.fail)
     client = TikTokLiveClient(unique_id=f"@{username}")
     client.logger.setLevel(logging.ERROR)
     apply_optional_session(client, state)
@@ -413,21 +559,22 @@ async def capture_live_stream(args: argparse.Namespace) -> int:
             emit_line({"type": "meta", **state.snapshot()})
             emit_line({"type": "sample", **state.add_sample()})
             emit_line({"type": "end", "ok": True, "isLive": False, "warnings": state.warnings, "error": None})
+            flush_emitted()
             return 0
 
         emit_line({"type": "meta", **state.snapshot()})
 
-        stop_at = time.monotonic() + duration_sec if duration_sec > 0 else None
-        next_sample_at = time.monotonic()
-        while stop_at is None or time.monotonic() < stop_at:
-            if time.monotonic() >= next_sample_at:
-                emit_line({"type": "sample", **state.add_sample()})
-                next_sample_at += sample_interval_sec
-            await asyncio.sleep(0.15)
+        await sample_until_done(
+            state,
+            duration_sec if duration_sec > 0 else None,
+            sample_interval_sec,
+            lambda sample: emit_line({"type": "sample", **sample}),
+        )
 
         emit_line({"type": "sample", **state.add_sample()})
         await safe_disconnect(client, state)
         emit_line({"type": "end", "ok": True, "isLive": True, "warnings": state.warnings, "error": None})
+        flush_emitted()
         return 0
     except Exception as capture_error:
         await safe_disconnect(client, state)
@@ -445,6 +592,7 @@ async def capture_live_stream(args: argparse.Namespace) -> int:
                 "error": text,
             }
         )
+        flush_emitted()
         return 1
 
 
@@ -464,6 +612,7 @@ async def main() -> None:
     parser = build_parser()
     args = parser.parse_args()
     if args.mode == "stream":
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
         code = await capture_live_stream(args)
         raise SystemExit(code)
 
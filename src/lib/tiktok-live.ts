@@ -1062,6 +1062,8 @@ function startStreamingJob(sessionId: string, input: TrackLiveInput): void {
     }
   };
 
+  // Stream lines are UTF-8; decode across chunk boundaries so split characters survive.
+  child.stdout.setEncoding("utf8");
   child.stdout.on("data", (chunk) => {
     stdoutBuffer += String(chunk);
     while (true) {